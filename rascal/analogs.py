@@ -710,8 +710,7 @@ def get_analog_pool(
             window_size=vw_size,
             window_type=vw_type
         )
-        validation_window = pd.to_datetime(validation_window)
-        validation_dates = sorted(list(set(training_dates) - set(validation_window)))
+        validation_dates = training_dates.difference(validation_window)
 
         # Find distances in the PC space to the point to predict
         distances = calculate_distances(
@@ -821,7 +821,7 @@ def get_common_data(x, y):
     # Clean DataFrames of possible conflictive values
     # x = clean_df(x)
     # y = clean_df(y)
-    common_idx = list(set(x.index).intersection(y.index))
+    common_idx = x.index.intersection(y.index)
     x = x.loc[common_idx]
     y = y.loc[common_idx]
     return x, y
@@ -1077,7 +1077,7 @@ def get_skill(observation, simulations, **kwargs):
 
 def get_month_year_bias(predicted, observed):
     # Check if the columns are the same
-    common_cols = list(set(predicted.columns) & set(observed.columns))
+    common_cols = [col for col in predicted.columns if col in observed.columns]
 
     for col in common_cols:
         # Get common data
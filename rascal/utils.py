@@ -9,7 +9,6 @@ import pickle
 import typing
 import datetime
 import functools
-import itertools
 
 import numpy as np
 import pandas as pd
@@ -18,6 +17,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 
 from time import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 coordinate_names = ["time", "latitude", "longitude"]
@@ -41,8 +41,12 @@ class Preprocess:
         """
         self._check_variable_in_obj(self._obj, ['WSPD', 'WDIR'])
 
-        self._obj['U'] = self._obj['WSPD'] * np.deg2rad(270 - self._obj['WDIR']).apply(np.cos)
-        self._obj['V'] = self._obj['WSPD'] * np.deg2rad(270 - self._obj['WDIR']).apply(np.sin)
+        wspd = self._obj['WSPD'].to_numpy(dtype=np.float64)
+        wdir = self._obj['WDIR'].to_numpy(dtype=np.float64)
+        rad = np.deg2rad(270 - wdir)
+
+        self._obj['U'] = wspd * np.cos(rad)
+        self._obj['V'] = wspd * np.sin(rad)
 
         if substitute:
             self._obj.drop(['WSPD', 'WDIR'], axis=1, inplace=True)
@@ -63,20 +67,23 @@ class Preprocess:
         Calculate relative humidity from dew point temperature and air temperature
         :return:
         """
-        e0 = 0.611  # [kPa]
         l_rv = 5423  # L/Rv [K]
-        t0 = 273  # [K]
-
-        # Water vapor pressure
-        self._obj['E'] = self._obj['TDEW'].apply(lambda x: e0 * np.exp(l_rv * ((1 / t0) - (1 / x))))
 
-        # Saturation water vapor pressure
-        self._obj['ES'] = self._obj['TMPA'].apply(lambda x: e0 * np.exp(l_rv * ((1 / t0) - (1 / x))))
+        tdew = self._obj['TDEW'].to_numpy(dtype=np.float64)
+        tmpa = self._obj['TMPA'].to_numpy(dtype=np.float64)
 
-        # Relative humidity
-        self._obj['RHMA'] = (self._obj['E'] / self._obj['ES']) * 100
+        # Relative humidity as the ratio of water vapor pressure E = e0 * exp(L/Rv * (1/t0 - 1/TDEW)) to saturation
+        # water vapor pressure ES = e0 * exp(L/Rv * (1/t0 - 1/TMPA)). The e0 and t0 terms cancel out.
+        # The whole expression is evaluated in a single buffer to avoid allocating temporaries
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            rhma = np.reciprocal(tmpa)
+            rhma -= np.reciprocal(tdew)
+            rhma *= l_rv
+            np.exp(rhma, out=rhma)
+            rhma *= 100
+        rhma[(tdew == 0) | (tmpa == 0)] = np.nan
 
-        del self._obj['E'], self._obj['ES']
+        self._obj['RHMA'] = rhma
 
     def get_daily_variables(self, skipna: bool = True, grouping: str = None) -> pd.DataFrame:
         """
@@ -211,10 +218,10 @@ def clean_dataset(df: pd.DataFrame) -> pd.DataFrame:
     :return df: DataFrame or Series. Cleaned vesion of original df.
     """
     assert isinstance(df, pd.DataFrame), "df needs to be a pd.DataFrame"
-    df.dropna(inplace=True)
-    indices_to_keep = ~df.isin([np.nan, np.inf, -np.inf]).any(axis="columns")
+    values = df.to_numpy(dtype=np.float64)
+    indices_to_keep = np.isfinite(values).all(axis=1)
 
-    return df[indices_to_keep].astype(np.float64)
+    return pd.DataFrame(values[indices_to_keep], index=df.index[indices_to_keep], columns=df.columns)
 
 
 def get_common_index(df1: pd.DataFrame, df2: pd.DataFrame):
@@ -226,7 +233,7 @@ def get_common_index(df1: pd.DataFrame, df2: pd.DataFrame):
     df2 = clean_dataset(df2)
 
     # Get only the common data
-    common_idx = sorted(list(set(df1.index).intersection(df2.index)))
+    common_idx = df1.index.intersection(df2.index).sort_values()
     df1 = df1.loc[common_idx]
     df2 = df2.loc[common_idx]
 
@@ -243,7 +250,7 @@ def get_validation_window(test_date, dates, window_size: int, window_type: str =
         forward: The original date is the last date of the window.
         backward: The original date is the firs date of the window.
         centered: The original date is in the center of the window.
-    :return validation_window: list. Dates in the window.
+    :return validation_window: DatetimeIndex. Sorted dates in the window.
     """
 
     if window_type not in ['forward', 'back', 'centered']:
@@ -263,7 +270,7 @@ def get_validation_window(test_date, dates, window_size: int, window_type: str =
             final_date = test_date + datetime.timedelta(days=int(np.floor(window_size / 2)))
 
         validation_window = pd.date_range(start=initial_date, end=final_date, freq='1D')
-        validation_window = list(set(validation_window) & set(dates))
+        validation_window = pd.DatetimeIndex(dates).intersection(validation_window)
 
         return validation_window
 
@@ -274,22 +281,23 @@ def open_observations(path: str, variables: list) -> pd.DataFrame:
     :param path: str. Path of the files to open.
     :param variables: list. Acronyms as str of the variables to open.
     """
-    # Declare an empty dataframe for the complete observations
-    data = pd.DataFrame()
+    # Declare an empty list for the observations of each variable
+    variables_data = []
     # List of all the files in the directory of observations of the station
     files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
     # Search the desired observed variable file through all the files in the directory
-    for file, variable in itertools.product(files, variables):
-        # Open if the file corresponds to the selected variable
-        if file.find(variable) != -1:
+    for variable in variables:
+        # Open the files corresponding to the selected variable
+        for file in [f for f in files if variable in f]:
             # Open the file
             variable_data = pd.read_csv(path + file, index_col=0)
             # Rename the values column
             variable_data.columns.values[0] = variable
             # Change the format of the index to datetime
             variable_data.index = pd.to_datetime(variable_data.index)
-            # Add to the complete DataFrame
-            data = pd.concat([data, variable_data], axis=1)
+            variables_data.append(variable_data)
+    # Join all the observations in one DataFrame
+    data = pd.concat(variables_data, axis=1) if variables_data else pd.DataFrame()
     # Check if the data exists
     if data.empty:
         print('Warning: Empty data. Files may not exist in ' + path)
@@ -315,23 +323,23 @@ def get_files(nwp_path: str, variables: list, dates: list, file_format: str) ->
     :return all_file_paths: dict. Lists of all data file paths for each variable
     """
 
-    # List of al the grib files
-    all_file_paths = {}
-    for variable in variables:
-        # Get all file paths
-        file_paths = [np.nan] * len(dates)
-        for i, year in enumerate(dates):
-            file_name = (nwp_path + 'y_' + str(year) + '/' + str(year) + '_' + str(variable) + file_format)
-            # If the file exists, put the path in the list and save the correspondent date and hours
-            if os.path.isfile(file_name):
-                # Put the daily grib file name in the total file names array
-                file_paths[i] = file_name
-            else:
-                print(file_name + ' does not exist')
-        # Delete empty slots
-        file_paths = [item for item in file_paths if not (pd.isnull(item)) is True]
-        # Add files to the dictionary
-        all_file_paths[variable] = file_paths
+    # List of al the candidate grib files
+    candidates = [
+        (variable, nwp_path + 'y_' + str(year) + '/' + str(year) + '_' + str(variable) + file_format)
+        for variable in variables for year in dates
+    ]
+
+    # Check if the files exist concurrently, the stat calls release the GIL
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        file_exists = list(executor.map(os.path.isfile, [file_name for _, file_name in candidates]))
+
+    all_file_paths = {variable: [] for variable in variables}
+    for (variable, file_name), exists in zip(candidates, file_exists):
+        # If the file exists, put the path in the list of the variable
+        if exists:
+            all_file_paths[variable].append(file_name)
+        else:
+            print(file_name + ' does not exist')
 
     return all_file_paths
 
@@ -361,8 +369,7 @@ def group_data(ds, grouping: str = None):
 
     if isinstance(hour, str):
         hour = int(hour.replace("hour", ""))
-        ds_time = [date for date in pd.to_datetime(ds['time'].values) if date.hour == hour]
-        ds = ds.sel(time=ds_time)
+        ds = ds.isel(time=pd.DatetimeIndex(ds['time'].values).hour == hour)
 
     if group_type == 'sum':
         ds = ds.resample(time=frequency).sum()
@@ -399,15 +406,26 @@ def open_data(files_paths: dict, grouping: str = None, number: int = None, domai
     :param domain: list [minimum latitude, maximum latitude, minimum longitude, maximum longitude]
     :return combined: DataArray. All files concatenated in time
     """
+    # List the content of each directory only once, instead of checking every file path separately
+    directories = {os.path.dirname(file_path) for files in files_paths.values() for file_path in files}
+    existing_files = {
+        directory: {entry.name for entry in os.scandir(directory or '.') if entry.is_file()}
+        for directory in directories if os.path.isdir(directory or '.')
+    }
+
     combined_ds = []
     for variable, files in files_paths.items():
         # Check if the file exists
-        for file_path in files:
-            if not os.path.isfile(file_path):
+        file_exists = [
+            os.path.basename(file_path) in existing_files.get(os.path.dirname(file_path), set())
+            for file_path in files
+        ]
+        for file_path, exists in zip(files, file_exists):
+            if not exists:
                 print('     The file ' + file_path + ' does not exist')
-                files.remove(file_path)
+        files = [file_path for file_path, exists in zip(files, file_exists) if exists]
         # Load to xarray
-        variable_ds = xr.open_mfdataset(files)
+        variable_ds = xr.open_mfdataset(files, chunks={'time': 'auto'}, parallel=True)
         # Reduce memory usage
         variable_ds = variable_ds.astype(np.float32)
         # Clean unidimensional coordinates to avoid merging problems
@@ -455,11 +473,8 @@ def get_nearest_gridpoint(
     :param point_latitude: float.
     :return data: DataSet. Original dataset in the nearest gridpoint to the selected latitude and longitude.
     """
-    nearest_latitude_distance = min(abs(grid_latitudes - point_latitude))
-    nearest_longitude_distance = min(abs(grid_longitudes - point_longitude))
-
-    ilat = list(abs(grid_latitudes - point_latitude)).index(nearest_latitude_distance)
-    ilon = list(abs(grid_longitudes - point_longitude)).index(nearest_longitude_distance)
+    ilat = int(np.argmin(np.abs(np.asarray(grid_latitudes) - point_latitude)))
+    ilon = int(np.argmin(np.abs(np.asarray(grid_longitudes) - point_longitude)))
 
     return ilat, ilon
 
@@ -515,15 +530,11 @@ def crop_domain(
     if i_max_lon != len(grid_longitudes):
         i_max_lon = i_max_lon + grid_buffer[0]
 
-    # Crop domain to a point, line or 2D grid
-    if i_max_lat == i_min_lat and i_max_lon != i_min_lon:
-        data = data.isel(latitude=i_max_lat, longitude=slice(i_min_lon, i_max_lon))
-    elif i_max_lat != i_min_lat and i_max_lon == i_min_lon:
-        data = data.isel(latitude=slice(i_max_lat, i_min_lat), longitude=i_max_lon)
-    elif i_max_lat == i_min_lat and i_max_lon == i_min_lon:
-        data = data.isel(latitude=i_max_lat, longitude=i_max_lon)
-    else:
-        data = data.isel(latitude=slice(i_max_lat, i_min_lat), longitude=slice(i_min_lon, i_max_lon))
+    # Crop domain to a point, line or 2D grid. An axis whose limits share the same grid point is reduced to it
+    latitude_selection = i_max_lat if i_max_lat == i_min_lat else slice(i_max_lat, i_min_lat)
+    longitude_selection = i_max_lon if i_max_lon == i_min_lon else slice(i_min_lon, i_max_lon)
+
+    data = data.isel(latitude=latitude_selection, longitude=longitude_selection)
 
     return data
 
@@ -536,28 +547,20 @@ def separate_concatenated_components(data):
     """
 
     # Get the middle longitude of the variable
-    middle_index = int(len(data['longitude'].values) / 2)
-
-    # Divide the concatenated longitudes
-    u_index = range(middle_index)
-    v_index = range(middle_index, len(data['longitude'].values + 1))
+    middle_index = len(data['longitude']) // 2
 
     # Split the eof in the u and v components
-    data_u = data.isel(longitude=u_index)
-    data_v = data.isel(longitude=v_index)
+    data_u = data.isel(longitude=slice(0, middle_index))
+    data_v = data.isel(longitude=slice(middle_index, None))
 
     # Change the longitude values of v to the original latitudes
     data_v = data_v.assign_coords(longitude=data_u['longitude'].values)
 
-    # Change the name of the components
-    data_u.name = 'u'
-    data_v.name = 'v'
-
-    # Combine in one dataset
-    data = xr.combine_by_coords([data_u, data_v])
+    # Combine in one dataset. Both components share the same coordinates, so no alignment is needed
+    data = xr.Dataset({'u': data_u, 'v': data_v})
 
     # Calculate the module of the vector
-    data['module'] = np.sqrt(data['u'] ** 2 + data['v'] ** 2)
+    data['module'] = np.hypot(data['u'], data['v'])
 
     return data
 
@@ -605,12 +608,14 @@ def table_to_series(df: pd.DataFrame, new_index) -> pd.DataFrame:
     Transform a table of hourly values per month to a time series.
     """
 
-    climatology_series = pd.DataFrame(index=new_index, columns=df.columns)
+    new_index = pd.DatetimeIndex(new_index)
+
+    # Row of the table ("hour_month") that corresponds to each date of the series
+    table_rows = new_index.hour.astype(str) + '_' + new_index.month.astype(str)
 
-    for variable in df.columns:
-        for month, month_dataset in climatology_series.groupby(climatology_series.index.month):
-            for hour, hourly_dataset in month_dataset.groupby(month_dataset.index.hour):
-                climatology_series.loc[hourly_dataset.index, variable] = df.loc[str(hour) + '_' + str(month), variable]
+    # Fill a float64 array at once instead of assigning group by group into an object DataFrame
+    values = df.loc[table_rows].to_numpy(dtype=np.float64)
+    climatology_series = pd.DataFrame(values, index=new_index, columns=df.columns)
 
     return climatology_series
 